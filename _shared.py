@@ -0,0 +1,86 @@
+# _shared.py
+"""
+Helpers shared by default_bot and scholarship_bot (no Streamlit).
+"""
+
+import os
+from functools import cache
+from typing import Dict, List, Optional
+
+import httpx
+import tiktoken
+from openai import AsyncOpenAI, DefaultAsyncHttpxClient
+
+# ========= Config =========
+MAX_TURNS_TO_SEND = 6  # past messages sent with each request; keep convo short to reduce drift/cost
+HISTORY_TOKEN_BUDGET = 2000  # max tokens of past turns sent with each request
+
+# Warm HTTP/2 connections: reuse skips TCP/TLS setup on every turn
+HTTP_LIMITS = httpx.Limits(max_keepalive_connections=32, max_connections=64, keepalive_expiry=60)
+HTTP_TIMEOUT = httpx.Timeout(120.0, connect=5.0)  # fail fast on connect; batched searches can take a while
+
+
+@cache
+def _load_dotenv() -> None:
+    from dotenv import load_dotenv  # dev-only dependency; never imported when env is already set
+    load_dotenv()
+
+
+def ensure_env(name: str) -> Optional[str]:
+    """
+    os.environ[name], reading .env (once per process) only if it isn't set yet.
+    Deploys configured through env vars / Streamlit Secrets skip the file entirely.
+    """
+    if not os.getenv(name):
+        _load_dotenv()
+    return os.getenv(name)
+
+
+def create_client() -> AsyncOpenAI:
+    """
+    AsyncOpenAI over a tuned httpx pool (HTTP/2 multiplexing + keep-alive).
+    Build it once and reuse it (main.py caches it with st.cache_resource).
+    """
+    if not ensure_env("OPENAI_API_KEY"):
+        raise RuntimeError("OPENAI_API_KEY not set")
+    return AsyncOpenAI(
+        http_client=DefaultAsyncHttpxClient(http2=True, limits=HTTP_LIMITS, timeout=HTTP_TIMEOUT)
+    )
+
+
+@cache
+def _encoder() -> tiktoken.Encoding:
+    return tiktoken.encoding_for_model("gpt-4o-mini")
+
+
+def fit_budget(msgs: List[Dict], n: int, budget: int = HISTORY_TOKEN_BUDGET) -> int:
+    """
+    How many of the last `n` messages to send: newest first, stopping before the
+    total content exceeds `budget` tokens. Returns a count, so callers can slice
+    (or fill a preallocated list) once.
+    """
+    enc = _encoder()
+    total = 0
+    k = 0
+    for i in range(len(msgs) - 1, max(len(msgs) - n, 0) - 1, -1):
+        t = len(enc.encode(msgs[i]["content"], disallowed_special=()))
+        if total + t > budget:
+            break
+        total += t
+        k += 1
+    return k
+
+
+def extract_usage(completion) -> Optional[Dict]:
+    """
+    Token usage from a completion (or the final chunk of a stream), or None.
+    Returns {"prompt_tokens": int, "completion_tokens": int, "total_tokens": int}.
+    """
+    u = getattr(completion, "usage", None)
+    if not u:
+        return None
+    return {
+        "prompt_tokens": u.prompt_tokens,
+        "completion_tokens": u.completion_tokens,
+        "total_tokens": u.total_tokens,
+    }
@@ -0,0 +1,149 @@
+# cache.py
+"""
+Response cache (Redis / Upstash)
+- Cache-aside for chat completions, keyed on the exact request sent to the model
+- Optional semantic lookup (RediSearch HNSW index) for paraphrased questions
+- Everything degrades to a cache miss when REDIS_URL is unset or Redis errors
+"""
+
+import hashlib
+from array import array
+from functools import cache
+from typing import Dict, List, Optional
+
+import orjson
+from openai import AsyncOpenAI, OpenAIError
+from redis.asyncio import Redis
+from redis.exceptions import RedisError, ResponseError
+
+from _shared import ensure_env
+
+# ========= Config =========
+CACHE_TTL = 3600  # seconds
+KEY_PREFIX = "chat:"
+REDIS_TIMEOUT = 1.0  # seconds; a dead/unreachable Redis becomes a quick miss, not an OS TCP timeout
+
+EMBED_MODEL = "text-embedding-3-small"
+EMBED_DIM = 1536
+SEMANTIC_INDEX = "idx:chat-sem"
+SEMANTIC_PREFIX = "chat-sem:"
+SEMANTIC_MAX_DISTANCE = 0.1  # cosine distance; lower = stricter paraphrase match
+
+_semantic_ready: Optional[bool] = None  # None = not checked yet
+
+
+# ========= Client =========
+@cache
+def get_redis() -> Optional[Redis]:
+    url = ensure_env("REDIS_URL")
+    if not url:
+        return None
+    return Redis.from_url(url, socket_connect_timeout=REDIS_TIMEOUT, socket_timeout=REDIS_TIMEOUT)
+
+
+# ========= Exact-match cache =========
+def hash_messages(messages: List[Dict], **params) -> str:
+    """
+    Stable digest of one chat request: the messages actually sent (system prompt
+    + trimmed history + user turn) plus model/sampling params.
+    """
+    payload = orjson.dumps({"messages": messages, **params}, option=orjson.OPT_SORT_KEYS)
+    return hashlib.blake2b(payload).hexdigest()
+
+
+async def get_cached(key: str) -> Optional[Dict]:
+    redis = get_redis()
+    if redis is None:
+        return None
+    try:
+        raw = await redis.get(KEY_PREFIX + key)
+    except RedisError:
+        return None
+    return orjson.loads(raw) if raw else None
+
+
+async def set_cached(key: str, value: Dict, ttl: int = CACHE_TTL) -> None:
+    redis = get_redis()
+    if redis is None:
+        return
+    try:
+        await redis.set(KEY_PREFIX + key, orjson.dumps(value), ex=ttl)
+    except RedisError:
+        pass
+
+
+# ========= Semantic cache =========
+async def _ensure_index(redis: Redis) -> bool:
+    """
+    Create the HNSW vector index once per process.
+    Plain Redis / Upstash without RediSearch just disables semantic lookups.
+    """
+    global _semantic_ready
+    if _semantic_ready is None:
+        try:
+            await redis.execute_command(
+                "FT.CREATE", SEMANTIC_INDEX, "ON", "HASH", "PREFIX", 1, SEMANTIC_PREFIX,
+                "SCHEMA",
+                "ctx", "TAG",
+                "vec", "VECTOR", "HNSW", 6, "TYPE", "FLOAT32", "DIM", EMBED_DIM, "DISTANCE_METRIC", "COSINE",
+            )
+            _semantic_ready = True
+        except ResponseError as e:
+            _semantic_ready = "already exists" in str(e).lower()
+        except RedisError:
+            return False  # transient; try again next call
+    return _semantic_ready
+
+
+async def embed(client: AsyncOpenAI, text: str) -> Optional[bytes]:
+    """
+    FLOAT32 embedding of `text` for semantic lookups, or None when the
+    semantic cache is unavailable.
+    """
+    redis = get_redis()
+    if redis is None or not await _ensure_index(redis):
+        return None
+    try:
+        resp = await client.embeddings.create(model=EMBED_MODEL, input=text)
+    except OpenAIError:
+        return None
+    return array("f", resp.data[0].embedding).tobytes()
+
+
+async def semantic_get(ctx: str, vec: bytes) -> Optional[Dict]:
+    """
+    Nearest cached answer asked in the same context (`ctx` = hash of everything
+    but the user turn), if it is within SEMANTIC_MAX_DISTANCE.
+    """
+    redis = get_redis()
+    if redis is None:
+        return None
+    try:
+        res = await redis.execute_command(
+            "FT.SEARCH", SEMANTIC_INDEX,
+            f"(@ctx:{{{ctx}}})=>[KNN 1 @vec $vec AS dist]",
+            "PARAMS", 2, "vec", vec,
+            "RETURN", 2, "dist", "value",
+            "DIALECT", 2,
+        )
+    except RedisError:
+        return None
+    # Reply: [total, doc_id, [field, value, ...], ...]
+    if not res or res[0] == 0:
+        return None
+    fields = dict(zip(res[2][::2], res[2][1::2]))
+    if float(fields[b"dist"]) >= SEMANTIC_MAX_DISTANCE:
+        return None
+    return orjson.loads(fields[b"value"])
+
+
+async def semantic_set(ctx: str, vec: bytes, key: str, value: Dict, ttl: int = CACHE_TTL) -> None:
+    redis = get_redis()
+    if redis is None:
+        return
+    doc = SEMANTIC_PREFIX + key
+    try:
+        await redis.hset(doc, mapping={"ctx": ctx, "vec": vec, "value": orjson.dumps(value)})
+        await redis.expire(doc, ttl)
+    except RedisError:
+        pass
@@ -6,28 +6,27 @@ Default Chatbot (Tutor + Counselor in one)
 - Short history memory, structured prompts, concise answers
 """
 
-import os
-from typing import List, Dict, Optional
+import asyncio
+import functools
+from typing import AsyncIterator, List, Dict, Optional
 
-from dotenv import load_dotenv
-from openai import OpenAI
+from openai import AsyncOpenAI
 
-load_dotenv()
+import cache
+from _shared import MAX_TURNS_TO_SEND, create_client, extract_usage, fit_budget
+from memory import profile_prompt
 
 # ========= Config =========
 MODEL_DEFAULT = "gpt-4o-mini"  # Cheap, general-purpose
-MAX_TURNS_TO_SEND = 6  # keep convo short to reduce drift/cost
 
 
 # ========= Helpers =========
-def trim_history(msgs: List[Dict], n: int = MAX_TURNS_TO_SEND) -> List[Dict]:
-    return msgs[-n:]
-
-
+@functools.cache
 def system_instructions() -> str:
     """
     One unified assistant for AP/STEM tutoring and academic counseling.
     Concise, structured, with light step-by-step for math/science.
+    Constant, so it is built once and reused.
     """
     return """
 You are a friendly, precise academic assistant for high-school and college students.
@@ -66,79 +65,140 @@ def user_prompt_wrap(user_text: str) -> str:
     )
 
 
-def build_api_messages(chat_history: List[Dict], current_user_text: str, keep_history: bool = True) -> List[Dict]:
+def build_api_messages(
+    chat_history: List[Dict],
+    current_user_text: str,
+    keep_history: bool = True,
+    profile: Optional[Dict[str, str]] = None,
+) -> List[Dict]:
     """
     Convert your chat history into OpenAI Chat Completions format.
     Each history item: {"role": "user"/"assistant", "content": "..."}.
+    A saved student profile (grade, goals) goes in as a second system message.
     """
-    msgs: List[Dict] = [{"role": "system", "content": system_instructions()}]
-    if keep_history and chat_history:
-        msgs.extend(trim_history(chat_history))
-    msgs.append({"role": "user", "content": user_prompt_wrap(current_user_text)})
+    note = profile_prompt(profile)
+    head = 2 if note else 1
+    n = fit_budget(chat_history, MAX_TURNS_TO_SEND) if keep_history and chat_history else 0
+
+    # One list of the final length, filled in place (no trim/extend intermediates)
+    msgs: List[Dict] = [None] * (head + n + 1)
+    msgs[0] = {"role": "system", "content": system_instructions()}
+    if note:
+        msgs[1] = {"role": "system", "content": note}
+    if n:
+        msgs[head:head + n] = chat_history[-n:]
+    msgs[-1] = {"role": "user", "content": user_prompt_wrap(current_user_text)}
     return msgs
 
 
 # ========= Core call =========
-def create_client() -> OpenAI:
-    if not os.getenv("OPENAI_API_KEY"):
-        raise RuntimeError("OPENAI_API_KEY not set")
-    return OpenAI()
-
-
-def generate_default_response(
+async def stream_default_response(
     user_input: str,
     chat_history: Optional[List[Dict]] = None,
     keep_history: bool = True,
-    client: Optional[OpenAI] = None,
+    client: Optional[AsyncOpenAI] = None,
     model: str = MODEL_DEFAULT,
     temperature: float = 0.3,
     max_tokens: Optional[int] = None,
-) -> Dict:
+    profile: Optional[Dict[str, str]] = None,
+    result: Optional[Dict] = None,
+) -> AsyncIterator[str]:
     """
-    Single-call generation for the default (tutor+counselor) chatbot.
+    Streaming generation for the default (tutor+counselor) chatbot.
+    Yields text deltas as they arrive (feed straight into st.write_stream).
 
-    Returns:
-      {
-        "text": str,
-        "usage": {"prompt_tokens": int, "completion_tokens": int, "total_tokens": int} | None,
-        "updated_chat_history": List[Dict],
-        "model_used": str,
-      }
+    If `result` is given, it is filled once the stream finishes with the same
+    keys generate_default_response() returns.
     """
     if client is None:
         client = create_client()
 
     chat_history = chat_history or []
-    messages = build_api_messages(chat_history, user_input, keep_history=keep_history)
+    messages = build_api_messages(chat_history, user_input, keep_history=keep_history, profile=profile)
 
     kwargs = dict(model=model, messages=messages, temperature=temperature)
     if max_tokens is not None:
         kwargs["max_tokens"] = max_tokens  # optional cap
 
-    completion = client.chat.completions.create(**kwargs)
-
-    choice = completion.choices[0] if completion.choices else None
-    text = choice.message.content.strip() if choice and choice.message and choice.message.content else "[No content returned]"
+    # Cache-aside: identical requests (same prompt, history, params) skip the API
+    cache_key = cache.hash_messages(**kwargs)
+    cached = await cache.get_cached(cache_key)
+
+    if cached is not None:
+        text, usage = cached["text"], None
+        yield text
+    else:
+        completion = await client.chat.completions.create(
+            **kwargs,
+            stream=True,
+            stream_options={"include_usage": True},  # usage arrives on the final chunk
+        )
+
+        parts: List[str] = []
+        usage = None
+        async for chunk in completion:
+            usage = extract_usage(chunk) or usage
+            delta = chunk.choices[0].delta.content if chunk.choices else None
+            if delta:
+                parts.append(delta)
+                yield delta
+
+        text = "".join(parts).strip() or "[No content returned]"
+        if parts:
+            await cache.set_cached(cache_key, {"text": text})
 
     updated_chat_history = chat_history + [
         {"role": "user", "content": user_input},
         {"role": "assistant", "content": text},
     ]
 
-    usage = None
-    if hasattr(completion, "usage") and completion.usage:
-        usage = {
-            "prompt_tokens": completion.usage.prompt_tokens,
-            "completion_tokens": completion.usage.completion_tokens,
-            "total_tokens": completion.usage.total_tokens,
-        }
+    if result is not None:
+        result.update({
+            "text": text,
+            "usage": usage,
+            "updated_chat_history": updated_chat_history,
+            "model_used": model,
+            "cached": cached is not None,
+        })
+
+
+async def generate_default_response(
+    user_input: str,
+    chat_history: Optional[List[Dict]] = None,
+    keep_history: bool = True,
+    client: Optional[AsyncOpenAI] = None,
+    model: str = MODEL_DEFAULT,
+    temperature: float = 0.3,
+    max_tokens: Optional[int] = None,
+    profile: Optional[Dict[str, str]] = None,
+) -> Dict:
+    """
+    Single-call generation for the default (tutor+counselor) chatbot.
+    Drains stream_default_response() and returns the final result.
 
-    return {
-        "text": text,
-        "usage": usage,
-        "updated_chat_history": updated_chat_history,
-        "model_used": model,
-    }
+    Returns:
+      {
+        "text": str,
+        "usage": {"prompt_tokens": int, "completion_tokens": int, "total_tokens": int} | None,
+        "updated_chat_history": List[Dict],
+        "model_used": str,
+        "cached": bool,
+      }
+    """
+    result: Dict = {}
+    async for _ in stream_default_response(
+        user_input,
+        chat_history=chat_history,
+        keep_history=keep_history,
+        client=client,
+        model=model,
+        temperature=temperature,
+        max_tokens=max_tokens,
+        profile=profile,
+        result=result,
+    ):
+        pass
+    return result
 
 
 # ========= Optional CLI smoke test =========
@@ -146,7 +206,7 @@ if __name__ == "__main__":
     import sys
     prompt = " ".join(sys.argv[1:]) if len(sys.argv) > 1 else "Help me plan a 6-week AP Calc AB review."
     try:
-        res = generate_default_response(prompt, chat_history=[], keep_history=False)
+        res = asyncio.run(generate_default_response(prompt, chat_history=[], keep_history=False))
         print("\n--- ASSISTANT ---\n")
         print(res["text"])
         if res["usage"]:
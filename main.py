@@ -1,21 +1,36 @@
 # main.py
+import asyncio
 import os
+import re
+import threading
+import uuid
+import markdown
 import streamlit as st
+from markdown.extensions import Extension
+from openai import AsyncOpenAI
 
 # Local modules
-from default_bot import generate_default_response
-from scholarship_bot import generate_scholarship_response
+import memory
+from _shared import create_client, ensure_env
+from default_bot import generate_default_response, stream_default_response
+from scholarship_bot import (
+    MAX_BATCH_ROWS,
+    generate_scholarship_response,
+    generate_scholarship_response_batch,
+    stream_scholarship_response,
+)
 
 # --------------------------
 # Load API key (Secrets > env)
 # --------------------------
 def ensure_openai_key():
     """
-    Prefer Streamlit Secrets. Fall back to env var for local dev.
+    Prefer Streamlit Secrets. Fall back to env var (or .env) for local dev.
     Also writes the key into os.environ so downstream modules work.
     """
     secret_key = st.secrets.get("OPENAI_API_KEY", None)
-    env_key = os.getenv("OPENAI_API_KEY")
+    # With a secret, never touch .env
+    env_key = os.getenv("OPENAI_API_KEY") if secret_key else ensure_env("OPENAI_API_KEY")
     key = secret_key or env_key
     if key and env_key != key:
         os.environ["OPENAI_API_KEY"] = key
@@ -24,22 +39,131 @@ def ensure_openai_key():
 
 api_ok, api_source = ensure_openai_key()
 
+
+def ensure_redis_url():
+    """
+    Optional response cache: export REDIS_URL from Secrets when present.
+    Without it the bots simply call the API every time.
+    """
+    secret_url = st.secrets.get("REDIS_URL", None)
+    if secret_url and not os.getenv("REDIS_URL"):
+        os.environ["REDIS_URL"] = secret_url
+    return bool(os.getenv("REDIS_URL") if secret_url else ensure_env("REDIS_URL"))
+
+cache_ok = ensure_redis_url()
+
+# --------------------------
+# Async bridge (one shared event loop)
+# --------------------------
+@st.cache_resource
+def get_event_loop() -> asyncio.AbstractEventLoop:
+    """
+    One long-lived event loop on a daemon thread, shared by every session and rerun.
+    Async clients bind their connection pools to the loop they run on, so keeping
+    a single loop alive lets pooled connections be reused across reruns, and
+    concurrent chat sessions overlap their I/O-wait instead of blocking each other.
+    """
+    loop = asyncio.new_event_loop()
+    threading.Thread(target=loop.run_forever, daemon=True).start()
+    return loop
+
+
+def iter_async(agen):
+    """
+    Drive an async generator on the shared loop and yield its items synchronously,
+    so it can be handed to st.write_stream.
+    """
+    loop = get_event_loop()
+    try:
+        while True:
+            try:
+                yield asyncio.run_coroutine_threadsafe(agen.__anext__(), loop).result()
+            except StopAsyncIteration:
+                return
+    finally:
+        asyncio.run_coroutine_threadsafe(agen.aclose(), loop)
+
+
+def run_async(coro):
+    """Run a coroutine on the shared loop and wait for its result."""
+    return asyncio.run_coroutine_threadsafe(coro, get_event_loop()).result()
+
+# --------------------------
+# OpenAI client (one per process)
+# --------------------------
+@st.cache_resource
+def get_openai_client() -> AsyncOpenAI:
+    """
+    One AsyncOpenAI client per process, shared across reruns and sessions,
+    so its HTTP/2 keep-alive pool survives reruns.
+    """
+    return create_client()
+
 # --------------------------
 # Streamlit page config
 # --------------------------
 st.set_page_config(page_title="FFS Multi-Mode Chat", page_icon="🎓", layout="wide")
 st.title("🎓 FFS Multi-Mode Chat")
-st.caption("Toggle between a Default Tutor/Counselor assistant and a Scholarship Finder.")
+st.caption("Toggle between a Default Tutor/Counselor assistant and a Scholarship Finder, or ask both at once.")
+
+# --------------------------
+# Session id + memory backend
+# --------------------------
+# Random per browser session and never put in the URL: it is the only key to the
+# student's Redis history and profile, so a shared link must not carry it.
+# Stable across reruns; a page reload starts a fresh session.
+sid = st.session_state.setdefault("sid", uuid.uuid4().hex)
+
+HISTORY_KEYS = ("history_default", "history_scholarship", "history_both")
+
+
+# Storage: Redis when configured; st.session_state without it, or while Redis is erroring
+def load_history(key: str) -> list:
+    if cache_ok:
+        history = run_async(memory.load_history(sid, key))
+        if history is not None:
+            return history
+    return st.session_state.setdefault(key, [])  # list[{"role": "user"/"assistant", "content": str}]
+
+
+def save_turn(key: str, *msgs: dict) -> None:
+    if cache_ok and run_async(memory.append_history(sid, key, *msgs)):
+        return
+    history = st.session_state.setdefault(key, [])
+    history.extend(msgs)
+    del history[:-memory.HISTORY_WINDOW]  # same window as Redis
+
+
+def clear_history(*keys: str) -> None:
+    if cache_ok:
+        run_async(memory.clear_history(sid, *keys))
+    for key in keys:
+        st.session_state[key] = []
+
+
+def load_profile() -> dict:
+    if cache_ok:
+        profile = run_async(memory.load_profile(sid))
+        if profile is not None:
+            return profile
+    return st.session_state.setdefault("profile", {})
+
+
+def save_profile(profile: dict) -> None:
+    if cache_ok:
+        run_async(memory.save_profile(sid, profile))
+    st.session_state["profile"] = profile
 
 # --------------------------
 # Sidebar controls
 # --------------------------
 with st.sidebar:
     st.header("Mode & Settings")
-    mode = st.radio("Mode", ["Default Chatbot", "Scholarship Finder"], horizontal=False)
+    mode = st.radio("Mode", ["Default Chatbot", "Scholarship Finder", "Both"], horizontal=False)
 
     st.markdown(f"**API Key loaded:** {'✅' if api_ok else '❌'}"
                 + (f" ({api_source})" if api_source else ""))
+    st.markdown(f"**Response cache:** {'✅ Redis' if cache_ok else '— off'}")
 
     if not api_ok:
         st.info("Add OPENAI_API_KEY via App → ⋯ → Settings → Secrets (recommended), "
@@ -52,100 +176,273 @@ with st.sidebar:
         # Fixed model: gpt-4o-mini (no dropdown)
         st.write("**Model:** gpt-4o-mini")
         temperature = 0.3
-    else:
+    elif mode == "Scholarship Finder":
         # Fixed model: gpt-4o-mini-search-preview (no temperature control)
         st.write("**Model:** gpt-4o-mini-search-preview")
         temperature = None
+    else:
+        # Both fixed models, asked concurrently
+        st.write("**Models:** gpt-4o-mini + gpt-4o-mini-search-preview")
+        temperature = 0.3
+
+    # Refine: several sub-queries answered in one batched call
+    if mode == "Scholarship Finder":
+        refine_text = st.text_area(
+            f"Refine (one sub-query per line, max {MAX_BATCH_ROWS})",
+            placeholder="women-only STEM awards\nawards for HS seniors in Texas",
+        )
+        if st.button("Refine"):
+            refine_queries = [q.strip() for q in refine_text.splitlines() if q.strip()]
+            if len(refine_queries) > MAX_BATCH_ROWS:
+                st.warning(f"Using the first {MAX_BATCH_ROWS} sub-queries.")
+                refine_queries = refine_queries[:MAX_BATCH_ROWS]
+            # Picked up (once) by the chat area below
+            st.session_state["pending_refine"] = refine_queries
+
+    # Long-term memory: reused across chats and injected into prompts
+    st.subheader("Student profile")
+    saved_profile = load_profile()
+    profile = {
+        "grade": st.text_input("Grade", value=saved_profile.get("grade", ""), placeholder="e.g., 11").strip(),
+        "goals": st.text_input("Goals", value=saved_profile.get("goals", ""), placeholder="e.g., SAT 1450, pre-med").strip(),
+    }
+    if profile != {k: saved_profile.get(k, "") for k in profile}:
+        save_profile(profile)
+
+    history_key = {
+        "Default Chatbot": "history_default",
+        "Scholarship Finder": "history_scholarship",
+        "Both": "history_both",
+    }[mode]
 
     col1, col2 = st.columns(2)
     with col1:
         if st.button("Clear current chat"):
-            if mode == "Default Chatbot":
-                st.session_state["history_default"] = []
-            else:
-                st.session_state["history_scholarship"] = []
+            clear_history(history_key)
             st.rerun()
     with col2:
         if st.button("Clear ALL"):
+            clear_history(*HISTORY_KEYS)
+            if cache_ok:
+                run_async(memory.clear_profile(sid))
             st.session_state.clear()
             st.rerun()
 
 # --------------------------
-# Session state setup
+# Chat area (fragment: a chat turn reruns only this, not the sidebar/page)
 # --------------------------
-if "history_default" not in st.session_state:
-    st.session_state.history_default = []  # list[{"role": "user"/"assistant", "content": str}]
-if "history_scholarship" not in st.session_state:
-    st.session_state.history_scholarship = []
+def show_usage_caption(usage):
+    u = usage
+    st.caption(
+        f"Tokens — prompt: {u['prompt_tokens']} • completion: {u['completion_tokens']} • total: {u['total_tokens']}"
+    )
 
-history_key = "history_default" if mode == "Default Chatbot" else "history_scholarship"
-history = st.session_state[history_key]
 
-# --------------------------
-# Show chat history
-# --------------------------
-for msg in history:
-    with st.chat_message(msg["role"]):
-        st.markdown(msg["content"])
+def show_result_footer(result, show_usage):
+    if result["cached"]:
+        st.caption("Served from cache")
+    elif show_usage and result["usage"]:
+        show_usage_caption(result["usage"])
 
-# --------------------------
-# Chat input
-# --------------------------
-placeholder = (
-    "Ask anything—AP/STEM help, study plans, college planning…"
-    if mode == "Default Chatbot"
-    else "Ask for scholarships (e.g., 'women STEM scholarships for high school seniors')"
-)
-user_input = st.chat_input(placeholder)
 
-if user_input:
-    history.append({"role": "user", "content": user_input})
-    with st.chat_message("user"):
-        st.markdown(user_input)
+HISTORY_CSS = """
+<style>
+.chat-history .msg { padding: 0.5rem 0.9rem; margin: 0.4rem 0; border-radius: 0.6rem; }
+.chat-history .msg.user { background: rgba(128, 128, 128, 0.12); }
+.chat-history .msg .role { font-size: 0.8rem; opacity: 0.65; margin-bottom: 0.2rem; }
+</style>
+"""
 
-    if mode == "Default Chatbot":
-        # Fixed model: gpt-4o-mini
-        result = generate_default_response(
-            user_input=user_input,
-            chat_history=history[:-1],      # exclude just-added user
-            keep_history=keep_history,
-            model="gpt-4o-mini",
-            temperature=temperature if temperature is not None else 0.3,
-        )
-        text = result["text"]
-        usage = result["usage"]
 
-        with st.chat_message("assistant"):
-            st.markdown(text)
-            if show_usage and usage:
-                u = usage
-                st.caption(
-                    f"Tokens — prompt: {u['prompt_tokens']} • completion: {u['completion_tokens']} • total: {u['total_tokens']}"
-                )
+class EscapeRawHtml(Extension):
+    """Show raw HTML in messages as text (List<Integer>, #include <vector>, <style>…) instead of injecting it."""
 
-        history.append({"role": "assistant", "content": text})
+    def extendMarkdown(self, md):
+        md.preprocessors.deregister("html_block")
+        md.inlinePatterns.deregister("html")
 
-    else:
-        # Fixed model: gpt-4o-mini-search-preview
-        result = generate_scholarship_response(
-            user_input=user_input,
-            chat_history=history[:-1],
-            keep_history=keep_history,
-        )
-        text = result["clean_text"]
-        usage = result["usage"]
-        removed = result["flagged_chunks"]
 
-        with st.chat_message("assistant"):
-            st.markdown(text or "[No content returned]")
+@st.cache_data(max_entries=1000)
+def render_message_html(role, content):
+    """Markdown -> HTML for one past message; cached, so each message is converted once."""
+    label = "🧑 You" if role == "user" else "🎓 Assistant"
+    body = markdown.markdown(content, extensions=["fenced_code", "tables", "sane_lists", EscapeRawHtml()])
+    return f'<div class="msg {role}"><div class="role">{label}</div>{body}</div>'
+
+
+# LaTeX math ($$…$$, \(…\), \[…\], $x^2$), but not currency like "$5,000 — $10,000"
+_MATH_RE = re.compile(r"\$\$|\\\(|\\\[|\$[^\s$\d][^$]*\$")
+
+
+def show_history(history):
+    """
+    Past messages as static HTML blocks, one per run of consecutive messages.
+    Messages with LaTeX math use st.markdown instead, which renders math.
+    """
+    run = []
+    css = HISTORY_CSS  # st.html isn't iframed, so the styles apply page-wide; send them once
+
+    def flush():
+        nonlocal css
+        if run:
+            st.html(css + '<div class="chat-history">' + "".join(run) + "</div>")
+            run.clear()
+            css = ""
+
+    for m in history:
+        if _MATH_RE.search(m["content"]):
+            flush()
+            with st.chat_message(m["role"]):
+                st.markdown(m["content"])
+        else:
+            run.append(render_message_html(m["role"], m["content"]))
+    flush()
+
+
+async def generate_both(user_input, history, keep_history, profile, client):
+    """
+    Ask the tutor and the scholarship finder the same question concurrently:
+    total latency is the slower of the two calls, not their sum.
+    """
+    default_task = asyncio.create_task(generate_default_response(
+        user_input=user_input,
+        chat_history=history,
+        keep_history=keep_history,
+        client=client,
+        max_tokens=800,
+        profile=profile,
+    ))
+    scholar_task = asyncio.create_task(generate_scholarship_response(
+        user_input=user_input,
+        chat_history=history,
+        keep_history=keep_history,
+        client=client,
+        profile=profile,
+    ))
+    return await asyncio.gather(default_task, scholar_task)
+
+
+@st.fragment
+def chat_area(mode, history_key, keep_history, show_usage, temperature, profile):
+    # History (last HISTORY_WINDOW messages; the bots send only the newest few)
+    history = load_history(history_key)
+
+    # Show chat history as static HTML instead of a chat_message widget per turn;
+    # only the live turn below uses interactive widgets
+    if len(history) >= memory.HISTORY_WINDOW:
+        st.caption(f"Showing the last {memory.HISTORY_WINDOW} messages; older ones are no longer kept.")
+    show_history(history)
+
+    # New turn renders above the input box
+    turn = st.container()
+
+    # Chat input
+    placeholder = {
+        "Default Chatbot": "Ask anything—AP/STEM help, study plans, college planning…",
+        "Scholarship Finder": "Ask for scholarships (e.g., 'women STEM scholarships for high school seniors')",
+        "Both": "Ask both assistants (e.g., 'I'm a junior into biology—what should I plan for?')",
+    }[mode]
+    user_input = st.chat_input(placeholder)
+    refine_queries = st.session_state.pop("pending_refine", None)
+
+    if user_input:
+        user_msg = {"role": "user", "content": user_input}
+        with turn.chat_message("user"):
+            st.markdown(user_input)
+
+        if mode == "Default Chatbot":
+            # Fixed model: gpt-4o-mini
+            result = {}
+            stream = stream_default_response(
+                user_input=user_input,
+                chat_history=history,
+                keep_history=keep_history,
+                client=get_openai_client(),
+                model="gpt-4o-mini",
+                temperature=temperature if temperature is not None else 0.3,
+                max_tokens=800,  # bound completion length (latency scales with output)
+                profile=profile,
+                result=result,
+            )
+
+            with turn.chat_message("assistant"):
+                st.write_stream(iter_async(stream))
+                text = result["text"]
+                show_result_footer(result, show_usage)
+
+        elif mode == "Scholarship Finder":
+            # Fixed model: gpt-4o-mini-search-preview
+            result = {}
+            stream = stream_scholarship_response(
+                user_input=user_input,
+                chat_history=history,
+                keep_history=keep_history,
+                client=get_openai_client(),
+                profile=profile,
+                result=result,
+            )
+
+            with turn.chat_message("assistant"):
+                # Expired items are filtered out as they stream
+                st.write_stream(iter_async(stream))
+                text = result["clean_text"]
+                removed = result["flagged_chunks"]
+                if removed:
+                    st.info(f"Removed {len(removed)} expired scholarship(s).")
+                show_result_footer(result, show_usage)
+
+        else:
+            # Both: tutor + scholarship finder side by side, fetched concurrently
+            with turn.chat_message("assistant"):
+                with st.spinner("Asking both assistants…"):
+                    tutor, scholar = run_async(generate_both(
+                        user_input, history, keep_history, profile, get_openai_client()
+                    ))
+                col_tutor, col_scholar = st.columns(2)
+                with col_tutor:
+                    st.markdown("**Tutor / Counselor**")
+                    st.markdown(tutor["text"])
+                    show_result_footer(tutor, show_usage)
+                with col_scholar:
+                    st.markdown("**Scholarships**")
+                    st.markdown(scholar["clean_text"])
+                    if scholar["flagged_chunks"]:
+                        st.info(f"Removed {len(scholar['flagged_chunks'])} expired scholarship(s).")
+                    show_result_footer(scholar, show_usage)
+            text = (
+                f"**Tutor / Counselor**\n\n{tutor['text']}\n\n---\n\n"
+                f"**Scholarships**\n\n{scholar['clean_text']}"
+            )
+
+        save_turn(history_key, user_msg, {"role": "assistant", "content": text})
+
+    elif refine_queries:
+        # Refine (batched scholarship sub-queries)
+        refine_msg = {
+            "role": "user",
+            "content": "Refine:\n" + "\n".join(f"{i}) {q}" for i, q in enumerate(refine_queries, 1)),
+        }
+        with turn.chat_message("user"):
+            st.markdown(refine_msg["content"])
+
+        with turn.chat_message("assistant"):
+            with st.spinner(f"Searching {len(refine_queries)} sub-queries…"):
+                batch = run_async(generate_scholarship_response_batch(
+                    refine_queries,
+                    chat_history=history,
+                    client=get_openai_client(),
+                    profile=profile,
+                    keep_history=keep_history,
+                ))
+            text = "\n\n".join(f"### {i}) {r['query']}\n\n{r['clean_text']}" for i, r in enumerate(batch["results"], 1))
+            st.markdown(text)
+            removed = sum(len(r["flagged_chunks"]) for r in batch["results"])
             if removed:
-                st.info(f"Removed {len(removed)} expired scholarship(s).")
-            if show_usage and usage:
-                u = usage
-                st.caption(
-                    f"Tokens — prompt: {u['prompt_tokens']} • completion: {u['completion_tokens']} • total: {u['total_tokens']}"
-                )
+                st.info(f"Removed {removed} expired scholarship(s).")
+            if show_usage and batch["usage"]:
+                show_usage_caption(batch["usage"])
+
+        save_turn(history_key, refine_msg, {"role": "assistant", "content": text})
 
-        history.append({"role": "assistant", "content": text})
 
-    st.session_state[history_key] = history
+chat_area(mode, history_key, keep_history, show_usage, temperature, profile)
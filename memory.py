@@ -0,0 +1,104 @@
+# memory.py
+"""
+Chat memory (Redis)
+- Short-term: per-session transcript of recent turns (Redis LIST, RPUSH + LTRIM);
+  the bots send only the newest MAX_TURNS_TO_SEND of it
+- Long-term: per-session student profile (Redis HASH), injected into prompts
+- Requires REDIS_URL; on a Redis error loads return None and writes return False,
+  so main.py can fall back to st.session_state
+"""
+
+from typing import Dict, List, Optional
+
+import orjson
+from redis.exceptions import RedisError
+
+from _shared import MAX_TURNS_TO_SEND
+from cache import get_redis
+
+# ========= Config =========
+HISTORY_WINDOW = 10 * MAX_TURNS_TO_SEND  # messages kept for display; older ones are dropped
+SESSION_TTL = 7 * 24 * 3600  # drop abandoned sessions after a week
+PROFILE_FIELDS = ("grade", "goals")
+
+
+def _hist_key(sid: str, mode: str) -> str:
+    return f"hist:{sid}:{mode}"
+
+
+def _pref_key(sid: str) -> str:
+    return f"pref:{sid}"
+
+
+# ========= Short-term history =========
+async def load_history(sid: str, mode: str) -> Optional[List[Dict]]:
+    try:
+        raw = await get_redis().lrange(_hist_key(sid, mode), 0, -1)
+    except RedisError:
+        return None
+    return [orjson.loads(r) for r in raw]
+
+
+async def append_history(sid: str, mode: str, *msgs: Dict, window: int = HISTORY_WINDOW) -> bool:
+    """Append messages and keep only the newest `window` of them (O(1) per turn)."""
+    key = _hist_key(sid, mode)
+    try:
+        async with get_redis().pipeline(transaction=True) as pipe:
+            pipe.rpush(key, *(orjson.dumps(m) for m in msgs))
+            pipe.ltrim(key, -window, -1)
+            pipe.expire(key, SESSION_TTL)
+            await pipe.execute()
+    except RedisError:
+        return False
+    return True
+
+
+async def clear_history(sid: str, *modes: str) -> bool:
+    try:
+        await get_redis().delete(*(_hist_key(sid, m) for m in modes))
+    except RedisError:
+        return False
+    return True
+
+
+# ========= Long-term profile =========
+async def load_profile(sid: str) -> Optional[Dict[str, str]]:
+    try:
+        raw = await get_redis().hgetall(_pref_key(sid))
+    except RedisError:
+        return None
+    return {k.decode(): v.decode() for k, v in raw.items()}
+
+
+async def save_profile(sid: str, profile: Dict[str, str]) -> bool:
+    key = _pref_key(sid)
+    fields = {k: v for k, v in profile.items() if v}
+    try:
+        async with get_redis().pipeline(transaction=True) as pipe:
+            pipe.delete(key)
+            if fields:
+                pipe.hset(key, mapping=fields)
+                pipe.expire(key, SESSION_TTL)
+            await pipe.execute()
+    except RedisError:
+        return False
+    return True
+
+
+async def clear_profile(sid: str) -> bool:
+    try:
+        await get_redis().delete(_pref_key(sid))
+    except RedisError:
+        return False
+    return True
+
+
+def profile_prompt(profile: Optional[Dict[str, str]]) -> Optional[str]:
+    """
+    Render the student profile as a short system note, or None if empty.
+    Kept out of the main system prompt so that prompt stays identical across users.
+    """
+    lines = [f"- {k.capitalize()}: {profile[k]}" for k in PROFILE_FIELDS if profile and profile.get(k)]
+    if not lines:
+        return None
+    return "Known student profile (use it to tailor answers; don't re-ask for it):\n" + "\n".join(lines)
@@ -6,24 +6,84 @@ Scholarship Finder (functions only)
 - Exposes helpers to build messages, call the model, and post-clean expired items
 """
 
-import os
+import asyncio
+import json
 import re
+import time
 from datetime import datetime, UTC, date
-from typing import List, Dict, Tuple, Optional
+from functools import lru_cache
+from typing import AsyncIterator, Iterable, Iterator, List, Dict, Tuple, Optional
 
-from dotenv import load_dotenv
-from openai import OpenAI
+from openai import AsyncOpenAI
 
-load_dotenv()
+import cache
+from _shared import MAX_TURNS_TO_SEND, create_client, extract_usage, fit_budget
+from memory import profile_prompt
 
 # ====== Config ======
 MODEL = "gpt-4o-mini-search-preview"
-MAX_TURNS_TO_SEND = 6  # keep convo short to reduce token drift and cost
+MAX_BATCH_ROWS = 5  # sub-queries packed into one call; returns diminish past ~5
+BATCH_POLL_SECONDS = 60  # Batch API jobs finish within 24h; no need to poll hard
+BATCH_CACHE_TTL = 24 * 3600  # upper bound; keys embed today's date, so entries are capped at UTC midnight
+
+_DATE_RE = re.compile(r"\[([0-9]{4}-[0-9]{2}-[0-9]{2})\]")  # ISO deadline tag, e.g. [2025-12-31]
+_SPLIT_RE = re.compile(r"(?:\r?\n\s*){2,}")  # blank line(s) between scholarship chunks
+_SECTION_RE = re.compile(r"^###\s*\**\s*(\d+)\s*[.)]?\s*\**\s*$", re.MULTILINE)  # "### N" line (also "### **N**", "### N)")
+
+_PROMPT_LABEL = "Prompt: "  # precedes the raw user text in user_prompt_wrap()
+
+NO_OPEN_DEADLINES = "No still-open deadlines found. Try asking again or broadening your query."
+
+
+_day_cache: Tuple[int, str, date] = (-1, "", date.min)  # (UTC day number, ISO string, date)
+_INFLIGHT: Dict[str, "asyncio.Future[Optional[str]]"] = {}  # cache key -> raw answer of a call in progress
 
 
 # ====== Helpers from your backend (unchanged where possible) ======
+def _utc_today() -> Tuple[int, str, date]:
+    """
+    Today's UTC date, rebuilt only when the day rolls over: a time.time()
+    integer division per call instead of a timezone-aware datetime.now().
+    """
+    global _day_cache
+    bucket = int(time.time()) // 86400  # epoch days are UTC days
+    if bucket != _day_cache[0]:
+        today = datetime.now(UTC).date()
+        _day_cache = (bucket, today.isoformat(), today)
+    return _day_cache
+
+
 def today_iso() -> str:
-    return datetime.now(UTC).date().isoformat()
+    return _utc_today()[1]
+
+
+def _parse_iso(s: str) -> date:
+    """YYYY-MM-DD -> date by slicing (the regex already guarantees the shape)."""
+    return date(int(s[:4]), int(s[5:7]), int(s[8:10]))
+
+
+def _is_expired(scholarship: str, today: date) -> bool:
+    """True if the chunk's first line carries an ISO deadline [YYYY-MM-DD] before today."""
+    first_line = scholarship.split('\n', 1)[0]
+    match = _DATE_RE.search(first_line)
+    if match:
+        try:
+            return _parse_iso(match.group(1)) < today
+        except ValueError:
+            pass  # e.g. month 13
+    return False
+
+
+def _iter_kept(chunks: Iterable[str], today: date) -> Iterator[Tuple[Optional[str], Optional[str]]]:
+    """Yield (chunk, None) for kept chunks and (None, chunk) for expired ones; blanks are skipped."""
+    for scholarship in chunks:
+        scholarship = scholarship.strip()
+        if not scholarship:
+            continue
+        if _is_expired(scholarship, today):
+            yield None, scholarship
+        else:
+            yield scholarship, None
 
 
 def flag_expired_lines(output_text: str) -> Tuple[List[str], str]:
@@ -34,43 +94,27 @@ def flag_expired_lines(output_text: str) -> Tuple[List[str], str]:
 
     Note: Slightly adjusted to avoid deleting from the list during iteration.
     """
-    pattern = r"\[([0-9]{4}-[0-9]{2}-[0-9]{2})\]"
-    today = date.today()
+    today = _utc_today()[2]
+    kept: List[str] = []
     flagged: List[str] = []
 
-    chunks = [c.strip() for c in re.split(r'(?:\r?\n\s*){2,}', output_text.strip()) if c.strip()]
-    kept: List[str] = []
+    # Single pass over the split pieces (no intermediate stripped-chunks list)
+    for keep, expired in _iter_kept(_SPLIT_RE.split(output_text.strip()), today):
+        if keep:
+            kept.append(keep)
+        else:
+            flagged.append(expired)  # drop expired
 
-    for scholarship in chunks:
-        first_line = scholarship.split('\n', 1)[0]
-        match = re.search(pattern, first_line)
-        if match:
-            try:
-                deadline = date.fromisoformat(match.group(1))
-                if deadline < today:
-                    flagged.append(scholarship)
-                    continue  # drop expired
-            except Exception:
-                pass
-        kept.append(scholarship)
-
-    updated_text = (
-        "No still-open deadlines found. Try asking again or broadening your query."
-        if len(kept) == 0 else
-        "\n\n".join(kept)
-    )
+    updated_text = NO_OPEN_DEADLINES if len(kept) == 0 else "\n\n".join(kept)
     return flagged, updated_text
 
 
-def system_instructions() -> str:
-    TODAY = today_iso()
-    return f"""
+# Everything that never changes comes first, so every request (any user, any day)
+# starts with the same bytes and qualifies for OpenAI's automatic prompt caching.
+# The date only appears in the CONTEXT tail. Don't interpolate per-user fields here.
+_SYSTEM_PREFIX = """
     You are a research assistant that finds current scholarships on the public web.
 
-    CONTEXT:
-    - Today is {TODAY}. Do not list scholarships whose deadline is earlier than today.
-    - Exception: If the official sponsor page explicitly states that applications reopen annually and the new date is pending, include it and clearly mark: "Next cycle; date TBA".
-
     GOALS:
     - Aggregators are allowed, but always try to find and prefer the OFFICIAL sponsor page.
     - Never invent awards. If amount or deadline is unclear on the official page, write: "Deadline unclear on official page".
@@ -94,7 +138,7 @@ def system_instructions() -> str:
       Why it fits: 1 short sentence (e.g., HS seniors, STEM, nationwide).
       Eligibility: brief bullets of key constraints if present (e.g., class year, GPA, major, region). If none stated, write "Not specified on page."
       Women-only? Yes/No.
-      Last verified: {TODAY}
+      Last verified: <today's date from CONTEXT, as YYYY-MM-DD>
 
     RULES:
     - If the user mentions "female", "women", or similar, prioritize women-only awards at the top.
@@ -104,49 +148,255 @@ def system_instructions() -> str:
     - Avoid hyper-local or school-specific awards unless the prompt suggests a specific location or school.
     - Do not include paywalled or login-gated content.
     - Make sure to ONLY include scholarships targeted towards the students, not any other parts of their family (e.g. mothers, fathers, relatives).
-    """.strip()
+"""
+
+
+def system_instructions() -> str:
+    return _system_instructions_for(today_iso())
+
+
+@lru_cache(maxsize=2)
+def _system_instructions_for(TODAY: str) -> str:
+    """
+    Built once per UTC day, so the exact same string is sent all day;
+    maxsize=2 covers requests straddling midnight.
+    """
+    return (_SYSTEM_PREFIX + f"""
+    CONTEXT:
+    - Today is {TODAY}. Do not list scholarships whose deadline is earlier than today.
+    - Exception: If the official sponsor page explicitly states that applications reopen annually and the new date is pending, include it and clearly mark: "Next cycle; date TBA".
+    """).strip()
 
 
 def user_prompt_wrap(user_text: str) -> str:
+    return _user_prompt_header_for(today_iso()) + _PROMPT_LABEL + user_text
+
+
+def _user_prompt_unwrap(content: str) -> str:
+    """Raw user text back out of a user_prompt_wrap() message (the header never contains the label)."""
+    return content.partition(_PROMPT_LABEL)[2]
+
+
+@lru_cache(maxsize=2)
+def _user_prompt_header_for(today: str) -> str:
     return (
         "Find scholarships based on this prompt. "
         "Return 3–5 well-sourced items with links, per the format.\n\n"
-        f"Today is {today_iso()}. UNDER ZERO CIRCUMSTANCES WILL YOU list scholarships whose deadline is earlier than today. "
+        f"Today is {today}. UNDER ZERO CIRCUMSTANCES WILL YOU list scholarships whose deadline is earlier than today. "
         "If you cannot find any scholarships that are due after today, keep looking. "
         "If you cannot find any scholarships that do not contradict the user's specifications, keep looking.\n\n"
         "Reminder: include both the quoted deadline text and the ISO date like: \"August 31, 2025\" [2025-08-31].\n\n"
-        f"Prompt: {user_text}"
     )
 
 
-def build_api_messages(chat_history: List[Dict]) -> List[Dict]:
+def batch_prompt_wrap(user_texts: List[str]) -> str:
+    """
+    Pack several sub-queries into one user message; the model answers each
+    under its own "### N" header so the reply can be split back apart.
+    """
+    numbered = "\n".join(f"{i}) {t}" for i, t in enumerate(user_texts, 1))
+    return (
+        _user_prompt_header_for(today_iso())
+        + "Answer EACH numbered sub-query below separately. Begin each answer with a line containing only "
+        "\"### N\" (N = the sub-query number), then follow the output format for that sub-query.\n\n"
+        f"Sub-queries:\n{numbered}"
+    )
+
+
+def split_batch_sections(output_text: str, n: int) -> List[str]:
+    """
+    Split a batched reply on its "### N" header lines. Missing sections come back as "";
+    text before the first header (or the whole reply, if there are none) goes to section 1.
+    Titled headings like "### 1. Alpha" are body text, not section markers.
+    """
+    heads = [m for m in _SECTION_RE.finditer(output_text) if 1 <= int(m.group(1)) <= n]
+    sections = [""] * n
+    sections[0] = output_text[:heads[0].start() if heads else len(output_text)].strip()
+    for m, nxt in zip(heads, heads[1:] + [None]):
+        body = output_text[m.end():nxt.start() if nxt else len(output_text)].strip()
+        i = int(m.group(1)) - 1
+        sections[i] = f"{sections[i]}\n\n{body}".strip() if sections[i] else body
+    return sections
+
+
+def build_api_messages(
+    chat_history: List[Dict],
+    keep_history: bool = True,
+    profile: Optional[Dict[str, str]] = None,
+) -> List[Dict]:
     """
     Convert our chat history into OpenAI Chat Completions format.
-    We always prepend the current system instructions.
-    Then include up to MAX_TURNS_TO_SEND most recent turns.
+    We always prepend the current system instructions (plus the student profile, if any).
+    Then, if keep_history, include up to MAX_TURNS_TO_SEND most recent turns, within the history token budget.
     Each item in chat_history is a dict: {"role": "user"/"assistant", "content": "..."}.
     """
-    msgs: List[Dict] = [{"role": "system", "content": system_instructions()}]
-    recent = chat_history[-MAX_TURNS_TO_SEND:]
-    msgs.extend(recent)
+    note = profile_prompt(profile)
+    head = 2 if note else 1
+    n = fit_budget(chat_history, MAX_TURNS_TO_SEND) if keep_history and chat_history else 0
+
+    # One list of the final length, filled in place (no trim/extend intermediates)
+    msgs: List[Dict] = [None] * (head + n)
+    msgs[0] = {"role": "system", "content": system_instructions()}
+    if note:
+        msgs[1] = {"role": "system", "content": note}
+    if n:
+        msgs[head:] = chat_history[-n:]
     return msgs
 
 
 # ====== Core call helpers ======
-def create_client() -> OpenAI:
-    if not os.getenv("OPENAI_API_KEY"):
-        raise RuntimeError("OPENAI_API_KEY not set")
-    return OpenAI()
+async def stream_scholarship_response(
+    user_input: str,
+    chat_history: Optional[List[Dict]] = None,
+    keep_history: bool = True,
+    client: Optional[AsyncOpenAI] = None,
+    profile: Optional[Dict[str, str]] = None,
+    result: Optional[Dict] = None,
+) -> AsyncIterator[str]:
+    """
+    Streaming call to the search-preview model, filtered as it streams.
 
+    Deltas are buffered until a blank line closes a scholarship chunk; each
+    complete chunk is then dropped if its deadline has passed, or yielded right
+    away. So the first scholarship shows while the rest are still generating,
+    and expired ones never reach the screen. If `result` is given, it is filled
+    with the same keys generate_scholarship_response() returns.
 
-def generate_scholarship_response(
+    Identical requests arriving while one is already in flight (same event loop)
+    wait for that call's answer instead of paying for their own.
+    """
+    if client is None:
+        client = create_client()
+
+    chat_history = chat_history or []
+
+    # Build messages
+    msgs = build_api_messages(chat_history, keep_history=keep_history, profile=profile)
+    ctx = cache.hash_messages(msgs, model=MODEL)  # everything but the user turn
+    msgs.append({"role": "user", "content": user_prompt_wrap(user_input)})
+
+    # Cache-aside: exact match first
+    cache_key = cache.hash_messages(msgs, model=MODEL)
+    cached = await cache.get_cached(cache_key)
+
+    # Coalesce: follow an identical in-flight call, or lead one others can follow
+    inflight = None
+    if cached is None:
+        leader = _INFLIGHT.get(cache_key)
+        if leader is None:
+            inflight = _INFLIGHT[cache_key] = asyncio.get_running_loop().create_future()
+        else:
+            shared = await asyncio.shield(leader)
+            if shared is not None:  # None = leader failed; make our own call
+                cached = {"raw_text": shared}
+
+    try:
+        # Then the nearest paraphrase asked in the same context
+        vec = None
+        if cached is None:
+            vec = await cache.embed(client, user_input)
+            if vec is not None:
+                cached = await cache.semantic_get(ctx, vec)
+
+        usage = None
+
+        async def deltas() -> AsyncIterator[str]:
+            nonlocal usage
+            if cached is not None:
+                yield cached["raw_text"]
+                return
+            # Call the model (search-preview models only accept simple args)
+            completion = await client.chat.completions.create(
+                model=MODEL,
+                messages=msgs,
+                stream=True,
+                stream_options={"include_usage": True},
+            )
+            async for chunk in completion:
+                usage = extract_usage(chunk) or usage
+                delta = chunk.choices[0].delta.content if chunk.choices else None
+                if delta:
+                    yield delta
+
+        today = _utc_today()[2]
+        parts: List[str] = []
+        kept: List[str] = []
+        flagged: List[str] = []
+
+        def admit(scholarship: str) -> Optional[str]:
+            """Flag an expired chunk, or return the text to emit for a kept one."""
+            scholarship = scholarship.strip()
+            if not scholarship:
+                return None
+            if _is_expired(scholarship, today):
+                flagged.append(scholarship)
+                return None
+            kept.append(scholarship)
+            return scholarship if len(kept) == 1 else "\n\n" + scholarship
+
+        buffer = ""
+        async for delta in deltas():
+            parts.append(delta)
+            buffer += delta
+            *complete, buffer = _SPLIT_RE.split(buffer)  # last piece may still be growing
+            for scholarship in complete:
+                out = admit(scholarship)
+                if out:
+                    yield out
+        out = admit(buffer)
+        if out:
+            yield out
+        if not kept:
+            yield NO_OPEN_DEADLINES
+
+        raw_text = "".join(parts).strip() or "[No content returned]"
+        clean_text = "\n\n".join(kept) or NO_OPEN_DEADLINES
+
+        if parts and cached is None:
+            # Cache the raw answer; expiry filtering reruns on every hit.
+            # Written before the in-flight entry goes away, so an identical request
+            # always finds one or the other.
+            value = {"raw_text": raw_text}
+            await cache.set_cached(cache_key, value)
+            if vec is not None:
+                await cache.semantic_set(ctx, vec, cache_key, value)
+
+        if inflight is not None:
+            inflight.set_result(raw_text if parts else None)
+    finally:
+        if inflight is not None:
+            if _INFLIGHT.get(cache_key) is inflight:
+                del _INFLIGHT[cache_key]
+            if not inflight.done():
+                inflight.set_result(None)  # failed or abandoned: followers fall back to their own call
+
+    # Update history with cleaned assistant reply
+    updated_chat_history = chat_history + [
+        {"role": "user", "content": user_input},
+        {"role": "assistant", "content": clean_text},
+    ]
+
+    if result is not None:
+        result.update({
+            "raw_text": raw_text,
+            "clean_text": clean_text,
+            "flagged_chunks": flagged,
+            "usage": usage,
+            "updated_chat_history": updated_chat_history,
+            "cached": cached is not None,
+        })
+
+
+async def generate_scholarship_response(
     user_input: str,
     chat_history: Optional[List[Dict]] = None,
     keep_history: bool = True,
-    client: Optional[OpenAI] = None,
+    client: Optional[AsyncOpenAI] = None,
+    profile: Optional[Dict[str, str]] = None,
 ) -> Dict:
     """
     One-shot call to the search-preview model and cleanup.
+    Drains stream_scholarship_response() and returns the final result.
 
     Returns dict:
     {
@@ -155,58 +405,206 @@ def generate_scholarship_response(
       "flagged_chunks": List[str],
       "usage": {"prompt_tokens": int, "completion_tokens": int, "total_tokens": int} | None,
       "updated_chat_history": List[Dict],
+      "cached": bool,  # True also when served by an identical in-flight call
+    }
+    """
+    result: Dict = {}
+    async for _ in stream_scholarship_response(
+        user_input,
+        chat_history=chat_history,
+        keep_history=keep_history,
+        client=client,
+        profile=profile,
+        result=result,
+    ):
+        pass
+    return result
+
+
+async def generate_scholarship_response_batch(
+    user_inputs: List[str],
+    chat_history: Optional[List[Dict]] = None,
+    client: Optional[AsyncOpenAI] = None,
+    profile: Optional[Dict[str, str]] = None,
+    keep_history: bool = True,
+) -> Dict:
+    """
+    Answer up to MAX_BATCH_ROWS related sub-queries (e.g. "women-only", "STEM",
+    "HS seniors") in ONE call instead of one call each, then split and clean per sub-query.
+
+    Returns dict:
+    {
+      "results": [{"query": str, "raw_text": str, "clean_text": str, "flagged_chunks": List[str]}, ...],
+      "usage": {"prompt_tokens": int, "completion_tokens": int, "total_tokens": int} | None,
     }
     """
+    if not user_inputs:
+        raise ValueError("user_inputs is empty")
+    if len(user_inputs) > MAX_BATCH_ROWS:
+        raise ValueError(f"At most {MAX_BATCH_ROWS} sub-queries per batch (got {len(user_inputs)})")
+
     if client is None:
         client = create_client()
 
-    chat_history = chat_history or []
+    msgs = build_api_messages(chat_history or [], keep_history=keep_history, profile=profile)
+    msgs.append({"role": "user", "content": batch_prompt_wrap(user_inputs)})
 
-    # Build messages
-    msgs = build_api_messages(chat_history)
-    msgs.append({"role": "user", "content": user_prompt_wrap(user_input)})
-
-    # Call the model (search-preview models only accept simple args)
-    completion = client.chat.completions.create(
+    completion = await client.chat.completions.create(
         model=MODEL,
         messages=msgs,
     )
 
     choice = completion.choices[0] if completion.choices else None
-    raw_text = choice.message.content.strip() if choice and choice.message and choice.message.content else "[No content returned]"
+    raw_all = choice.message.content if choice and choice.message and choice.message.content else ""
 
-    # Post-filter expired lines
-    flagged, clean_text = flag_expired_lines(raw_text)
+    results = []
+    for query, raw_text in zip(user_inputs, split_batch_sections(raw_all, len(user_inputs))):
+        flagged, clean_text = flag_expired_lines(raw_text)
+        results.append({
+            "query": query,
+            "raw_text": raw_text,
+            "clean_text": clean_text,
+            "flagged_chunks": flagged,
+        })
 
-    # Update history with cleaned assistant reply
-    updated_chat_history = chat_history + [
-        {"role": "user", "content": user_input},
-        {"role": "assistant", "content": clean_text},
-    ]
+    return {"results": results, "usage": extract_usage(completion)}
 
-    usage = None
-    if hasattr(completion, "usage") and completion.usage:
-        usage = {
-            "prompt_tokens": completion.usage.prompt_tokens,
-            "completion_tokens": completion.usage.completion_tokens,
-            "total_tokens": completion.usage.total_tokens,
-        }
-
-    return {
-        "raw_text": raw_text,
-        "clean_text": clean_text,
-        "flagged_chunks": flagged,
-        "usage": usage,
-        "updated_chat_history": updated_chat_history,
-    }
+
+# ====== Batch API (non-interactive refresh) ======
+async def submit_batch(prompts: List[str], client: Optional[AsyncOpenAI] = None) -> str:
+    """
+    Queue fresh-history scholarship searches on the OpenAI Batch API
+    (half price, no RPM pressure; results within 24h). Returns the batch id.
+    """
+    if not prompts:
+        raise ValueError("prompts is empty")
+    if client is None:
+        client = create_client()
+
+    lines = []
+    for i, prompt in enumerate(prompts):
+        msgs = build_api_messages([])
+        msgs.append({"role": "user", "content": user_prompt_wrap(prompt)})
+        lines.append(json.dumps({
+            "custom_id": str(i),
+            "method": "POST",
+            "url": "/v1/chat/completions",
+            "body": {"model": MODEL, "messages": msgs},
+        }))
+
+    batch_file = await client.files.create(
+        file=("scholarship_batch.jsonl", "\n".join(lines).encode()),
+        purpose="batch",
+    )
+    batch = await client.batches.create(
+        input_file_id=batch_file.id,
+        endpoint="/v1/chat/completions",
+        completion_window="24h",
+    )
+    return batch.id
+
+
+async def wait_for_batch(
+    batch_id: str,
+    client: Optional[AsyncOpenAI] = None,
+    poll_seconds: int = BATCH_POLL_SECONDS,
+) -> str:
+    """Poll until the batch reaches a terminal state; returns that status."""
+    if client is None:
+        client = create_client()
+
+    while True:
+        batch = await client.batches.retrieve(batch_id)
+        if batch.status in ("completed", "failed", "expired", "cancelled"):
+            return batch.status
+        await asyncio.sleep(poll_seconds)
+
+
+async def collect_batch(batch_id: str, client: Optional[AsyncOpenAI] = None) -> List[Dict]:
+    """
+    Download a completed batch, drop expired items from each answer, and
+    pre-warm the response cache so users asking the same prompt get it instantly.
+
+    Cache keys are rebuilt from each submitted prompt with TODAY's date, so they match
+    what stream_scholarship_response() computes for the same prompt (no history/profile)
+    from now until UTC midnight, even if the batch was submitted on an earlier day.
+
+    Returns one dict per prompt, in submission order:
+      {"custom_id": str, "raw_text": str, "clean_text": str, "flagged_chunks": List[str], "error": str | None}
+    """
+    if client is None:
+        client = create_client()
+
+    batch = await client.batches.retrieve(batch_id)
+    if batch.status != "completed" or not batch.output_file_id:
+        raise RuntimeError(f"Batch {batch_id} is not ready (status: {batch.status})")
+
+    # custom_id -> original prompt, recovered from the submitted user message
+    prompts = {}
+    for line in (await client.files.content(batch.input_file_id)).text.splitlines():
+        if line.strip():
+            req = json.loads(line)
+            prompts[req["custom_id"]] = _user_prompt_unwrap(req["body"]["messages"][-1]["content"])
+
+    msgs = build_api_messages([])
+    ttl = min(BATCH_CACHE_TTL, 86400 - int(time.time()) % 86400)  # keys go stale at UTC midnight
+
+    results = []
+    for line in (await client.files.content(batch.output_file_id)).text.splitlines():
+        if not line.strip():
+            continue
+        row = json.loads(line)
+        custom_id = row["custom_id"]
+        response = row.get("response") or {}
+        if row.get("error") or response.get("status_code") != 200:
+            error = (row.get("error") or {}).get("message") or f"HTTP {response.get('status_code')}"
+            results.append({"custom_id": custom_id, "raw_text": "", "clean_text": "",
+                            "flagged_chunks": [], "error": error})
+            continue
+
+        choices = response["body"].get("choices") or []
+        raw_text = ((choices[0]["message"].get("content") or "").strip() if choices else "") or "[No content returned]"
+        flagged, clean_text = flag_expired_lines(raw_text)
+
+        if choices:
+            user_msg = {"role": "user", "content": user_prompt_wrap(prompts[custom_id])}
+            await cache.set_cached(
+                cache.hash_messages(msgs + [user_msg], model=MODEL),
+                {"raw_text": raw_text},
+                ttl=ttl,
+            )
+
+        results.append({"custom_id": custom_id, "raw_text": raw_text, "clean_text": clean_text,
+                        "flagged_chunks": flagged, "error": None})
+
+    results.sort(key=lambda r: int(r["custom_id"]))
+    return results
+
+
+async def refresh_batch(prompts: List[str], client: Optional[AsyncOpenAI] = None) -> List[Dict]:
+    """Submit, wait, collect: the whole nightly refresh in one call."""
+    if client is None:
+        client = create_client()
+    batch_id = await submit_batch(prompts, client=client)
+    status = await wait_for_batch(batch_id, client=client)
+    if status != "completed":
+        raise RuntimeError(f"Batch {batch_id} ended with status: {status}")
+    return await collect_batch(batch_id, client=client)
 
 
 # ====== Optional CLI smoke test ======
 if __name__ == "__main__":
     import sys
+    if sys.argv[1:2] == ["--refresh"]:
+        # Nightly refresh: python scholarship_bot.py --refresh "prompt 1" "prompt 2" ...
+        for r in asyncio.run(refresh_batch(sys.argv[2:])):
+            print(f"\n--- [{r['custom_id']}] ---\n")
+            print(r["error"] or r["clean_text"])
+        sys.exit(0)
+
     prompt = " ".join(sys.argv[1:]) if len(sys.argv) > 1 else "women STEM scholarships for high school seniors"
     try:
-        res = generate_scholarship_response(prompt, chat_history=[], keep_history=False)
+        res = asyncio.run(generate_scholarship_response(prompt, chat_history=[], keep_history=False))
         print("\n--- RAW ---\n")
         print(res["raw_text"])
         print("\n--- CLEAN ---\n")